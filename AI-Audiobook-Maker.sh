@@ -1,25 +1,49 @@
 #!/bin/bash
 
-# Function to check and install missing dependencies
-check_install_dependency() {
-    local dep=$1
-    if ! command -v $dep &> /dev/null; then
-        read -p "Dependency $dep is missing. Would you like to install it? (y/n): " choice
-        if [ "$choice" = "y" ]; then
-            sudo apt-get install $dep
+# Function to check for missing dependencies and install them
+check_install_dependencies() {
+    local missing=()
+    local dep
+    for dep in "$@"; do
+        command -v "$dep" &> /dev/null || missing+=("$dep")
+    done
+    [ ${#missing[@]} -eq 0 ] && return
+
+    read -p "Dependencies missing: ${missing[*]}. Would you like to install them? (y/n): " choice
+    if [ "$choice" != "y" ]; then
+        echo "Dependencies not installed: ${missing[*]}. Exiting."
+        exit 1
+    fi
+
+    # ospeak is a Python tool from PyPI; everything else comes from apt
+    local apt_deps=()
+    for dep in "${missing[@]}"; do
+        if [ "$dep" = "ospeak" ]; then
+            if command -v pipx &> /dev/null; then
+                pipx install ospeak
+            else
+                pip3 install --user ospeak
+            fi
         else
-            echo "Dependency $dep is not installed. Exiting."
-            exit 1
+            apt_deps+=("$dep")
         fi
+    done
+    [ ${#apt_deps[@]} -gt 0 ] && sudo apt-get install "${apt_deps[@]}"
+
+    # Check again rather than trusting the installers' exit status
+    local still_missing=()
+    for dep in "${missing[@]}"; do
+        command -v "$dep" &> /dev/null || still_missing+=("$dep")
+    done
+    if [ ${#still_missing[@]} -gt 0 ]; then
+        echo "Dependencies still missing after install: ${still_missing[*]}."
+        echo "Please install them manually (for ospeak, make sure ~/.local/bin is on your PATH). Exiting."
+        exit 1
     fi
 }
 
 # Check for dependencies
-check_install_dependency "dialog"
-check_install_dependency "lolcat"
-check_install_dependency "ffmpeg"
-check_install_dependency "bc"
-check_install_dependency "ospeak" # Adjust as needed for your system
+check_install_dependencies "dialog" "lolcat" "ffmpeg" "ospeak" # Adjust ospeak as needed for your system
 
 
 # Function to exit if user presses 'Cancel' on the final confirmation
@@ -31,8 +55,21 @@ handle_cancel() {
     fi
 }
 
+# Function to stop any part conversions still running in the background
+stop_conversions() {
+    local pid
+    for pid in $(jobs -p); do
+        pkill -P "$pid" 2>/dev/null
+        kill "$pid" 2>/dev/null
+    done
+}
+
 # Function to handle the SIGINT signal (Ctrl-C)
 handle_sigint() {
+    # Background jobs ignore SIGINT, so stop them explicitly
+    stop_conversions
+    # Leave no half-stitched audiobook behind
+    [ -n "$PARTIAL_FILE" ] && rm -f "$PARTIAL_FILE"
 clear
     echo -e "\n\n👋 Goodbye! Thank you for using AI-Audiobook-Maker. Have a great day! 🌟\n"
     exit
@@ -49,8 +86,9 @@ calculate_parts_and_cost() {
     local total_parts=$((total_chars / max_length))
     [ $((total_chars % max_length)) -gt 0 ] && ((total_parts++))
     echo "$total_parts"
-    local cost=$(echo "scale=2; $total_chars / 1000 * 0.015" | bc)
-    printf "$%.2f USD" $cost
+    # $0.015 per 1,000 characters, rounded to the nearest cent
+    local cost_cents=$(( (total_chars * 15 + 5000) / 10000 ))
+    printf "$%d.%02d USD" $((cost_cents / 100)) $((cost_cents % 100))
 }
 
 split_text_file() {
@@ -60,9 +98,16 @@ split_text_file() {
     local part_num=1
     local buffer=""
     local buffer_len=0
+    local lines line
+    local prev_blank=1
 
-    while IFS= read -r line || [ -n "$line" ]; do
-        if [[ -z $line ]]; then
+    # Read the whole file in one go rather than line by line
+    mapfile -t lines < "$input_file"
+    for line in "${lines[@]}"; do
+        if [[ $line != *[![:space:]]* ]]; then
+            # Collapse runs of blank lines into a single paragraph break
+            (( prev_blank )) && continue
+            prev_blank=1
             if (( buffer_len + 2 > max_length )); then
                 echo "$buffer" > "${part_prefix}${part_num}.txt"
                 ((part_num++))
@@ -72,37 +117,94 @@ split_text_file() {
             buffer+=$'\n\n'
             buffer_len=$(( buffer_len + 2 ))
         else
+            prev_blank=0
             if (( buffer_len + ${#line} + 1 > max_length )); then
-                # Find the last period in the buffer
-                local last_period_pos=$(echo "$buffer" | grep -o '\.\(.*\)' | tail -1 | wc -c)
-                local split_pos=$(( ${#buffer} - last_period_pos + 1 ))
-                if [[ $split_pos -gt 1 ]]; then
+                # Split right after the last sentence end (. ! or ?) in the buffer,
+                # as long as what is carried over still fits alongside the new line
+                local head=${buffer%[.!?]*}
+                local split_pos=$(( ${#head} + 1 ))
+                if [[ $head != "$buffer" && $split_pos -gt 1 ]] &&
+                    (( buffer_len - split_pos + ${#line} + 1 <= max_length )); then
                     local part=${buffer:0:$split_pos}
                     echo "$part" > "${part_prefix}${part_num}.txt"
                     ((part_num++))
-                    buffer=${buffer:$split_pos}
-                    buffer_len=${#buffer}
+                    buffer=${buffer:$split_pos}$line$'\n'
+                    buffer_len=$(( buffer_len - split_pos + ${#line} + 1 ))
                 else
-                    echo "$buffer" > "${part_prefix}${part_num}.txt"
-                    ((part_num++))
+                    if [[ $buffer == *[![:space:]]* ]]; then
+                        echo "$buffer" > "${part_prefix}${part_num}.txt"
+                        ((part_num++))
+                    fi
                     buffer=$line$'\n'
-                    buffer_len=${#line} + 1
+                    buffer_len=$(( ${#line} + 1 ))
                 fi
             else
                 buffer+=$line$'\n'
                 buffer_len=$(( buffer_len + ${#line} + 1 ))
             fi
+
+            # A line longer than a whole part has to be cut up on its own: at the
+            # last sentence end that fits, else at the last space, else anywhere
+            while (( buffer_len > max_length )); do
+                local chunk=${buffer:0:$max_length}
+                local cut=${chunk%[.!?]*}
+                if [[ $cut != "$chunk" ]]; then
+                    split_pos=$(( ${#cut} + 1 ))
+                else
+                    cut=${chunk%[[:space:]]*}
+                    split_pos=${#cut}
+                    [[ $cut == "$chunk" || $split_pos -eq 0 ]] && split_pos=$max_length
+                fi
+                echo "${buffer:0:$split_pos}" > "${part_prefix}${part_num}.txt"
+                ((part_num++))
+                buffer=${buffer:$split_pos}
+                buffer_len=$(( buffer_len - split_pos ))
+            done
         fi
-    done < "$input_file"
+    done
 
-    if [ -n "$buffer" ]; then
+    if [[ $buffer == *[![:space:]]* ]]; then
         echo "$buffer" > "${part_prefix}${part_num}.txt"
+    else
+        ((part_num--))
+    fi
+
+    # Report how many parts were actually written
+    echo "$part_num"
+}
+
+# Function to convert one text part to an MP3 file
+convert_part() {
+    local file=$1
+    local mp3="${file%.txt}.mp3"
+    rm -f "$mp3"
+    # Feed the file straight to ospeak's stdin with the chosen speed and voice
+    ospeak --voice $VOICE --speed $SPEED -o "$mp3" < "$file" || return
+    # Fail on this part, not at the stitch step, if no audio came back
+    [ -s "$mp3" ]
+}
+
+# Function to wait for the oldest running conversion and exit if it failed
+wait_for_oldest_part() {
+    wait "${pids[0]}"
+    if [ $? -ne 0 ]; then
+        stop_conversions
+        echo -e "❌ Error occurred while converting part ${pid_parts[0]}. Exiting." | lolcat
+        exit 1
     fi
+    pids=("${pids[@]:1}")
+    pid_parts=("${pid_parts[@]:1}")
 }
 
 show_welcome_screen() {
-    local total_cost=$(calculate_parts_and_cost "input.txt" 4000 | tail -n1)
-    local welcome_message="Welcome to the Text-to-Speech Conversion Wizard! 🎙️✨\n\nThis tool helps you convert large text files into spoken words, split across multiple MP3 files.\n\n- It respects sentence boundaries, ensuring coherent audio segments.\n- You can choose different voices and control the speech speed.\n- The estimated cost for processing 'input.txt' is $total_cost (as of Jan 2024).\n\nPress OK to start configuring your conversion process."
+    # Only estimate the default file if it is there; otherwise the estimate
+    # is shown after the input file has been chosen
+    local cost_line="- The estimated cost is shown once you have chosen an input file."
+    if [ -f "input.txt" ]; then
+        local total_cost=$(calculate_parts_and_cost "input.txt" 4000 | tail -n1)
+        cost_line="- The estimated cost for processing 'input.txt' is $total_cost (as of Jan 2024)."
+    fi
+    local welcome_message="Welcome to the Text-to-Speech Conversion Wizard! 🎙️✨\n\nThis tool helps you convert large text files into spoken words, split across multiple MP3 files.\n\n- It respects sentence boundaries, ensuring coherent audio segments.\n- You can choose different voices and control the speech speed.\n$cost_line\n\nPress OK to start configuring your conversion process."
 
     dialog --title "Welcome" --msgbox "$welcome_message" 20 60
 }
@@ -123,6 +225,8 @@ if [ -z "${OPENAI_API_KEY}" ]; then
     exec 3>&-
     dialog --title "Confirmation ✅" --msgbox "API Key entered 🌐" 6 50
 fi
+# Make the key visible to every ospeak process
+export OPENAI_API_KEY
 
 # Get voice option
 exec 3>&1
@@ -152,48 +256,72 @@ SPEED=$(dialog --title "Speech Speed ⏩" --inputbox "Enter the speed (0.25 - 4.
 exec 3>&-
 dialog --title "Confirmation ✅" --msgbox "Speed adjusted to $SPEED ✨" 6 50
 
+# Get number of parallel conversions
+exec 3>&1
+MAX_JOBS=$(dialog --title "Parallel Conversions ⚡" --inputbox "How many parts to convert at once (default: 4):" 8 50 "4" 2>&1 1>&3)
+exec 3>&-
+[[ $MAX_JOBS =~ ^[1-9][0-9]*$ ]] || MAX_JOBS=4
+dialog --title "Confirmation ✅" --msgbox "Converting up to $MAX_JOBS parts at once ⚡" 6 50
+
 # Calculate parts and cost
-TOTAL_PARTS=$(calculate_parts_and_cost "$INPUT_FILE" 4000 | head -n1)
-FORMATTED_COST=$(calculate_parts_and_cost "$INPUT_FILE" 4000 | tail -n1)
+{ read -r TOTAL_PARTS; read -r FORMATTED_COST; } < <(calculate_parts_and_cost "$INPUT_FILE" 4000; echo)
 dialog --title "Estimation 📊" --msgbox "Estimated number of files: $TOTAL_PARTS 📈\nEstimated cost: $FORMATTED_COST 💰" 8 50
 
+# Don't silently replace an audiobook from an earlier run
+OUTPUT_FILE="output.mp3"
+if [ -e "$OUTPUT_FILE" ]; then
+    if ! dialog --title "Output Exists ⚠️" --yesno "'$OUTPUT_FILE' already exists.\n\nPress 'Yes' to overwrite it, or 'No' to keep it and save the new audiobook under a new name." 10 60; then
+        n=2
+        while [ -e "output_${n}.mp3" ]; do ((n++)); done
+        OUTPUT_FILE="output_${n}.mp3"
+    fi
+    dialog --title "Confirmation ✅" --msgbox "Audiobook will be saved as '$OUTPUT_FILE' 💾" 6 50
+fi
+PARTIAL_FILE="${OUTPUT_FILE%.mp3}.partial.mp3"
+
 # Final confirmation with cancel check
-exec 3>&1
 dialog --title "Final Confirmation 🚀" --yesno \
-    "Ready to start conversion with these settings?\n\n- Voice: $VOICE\n- Model: $MODEL\n- Speed: $SPEED\n- Estimated number of files: $TOTAL_PARTS\n- Estimated cost: $FORMATTED_COST\n\nPress 'Yes' to start, 'No' to exit." 15 60
-exec 3>&-
+    "Ready to start conversion with these settings?\n\n- Voice: $VOICE\n- Model: $MODEL\n- Speed: $SPEED\n- Parallel conversions: $MAX_JOBS\n- Output file: $OUTPUT_FILE\n- Estimated number of files: $TOTAL_PARTS\n- Estimated cost: $FORMATTED_COST\n\nPress 'Yes' to start, 'No' to exit." 15 60
 handle_cancel
-
-# Check response
-if [ $response -eq 1 ]; then
-    echo "Conversion canceled."
-    exit 0
-fi
 clear
-# Split and convert logic
-split_text_file "$INPUT_FILE" 4000 "part_"
+# Split and convert logic. Parts end on sentence boundaries, so there can be
+# more of them than estimated; convert however many were written.
+TOTAL_PARTS=$(split_text_file "$INPUT_FILE" 4000 "part_")
 
-# Convert each part to an MP3 file
+# Convert each part to an MP3 file. Each conversion mostly waits on the API,
+# so run up to MAX_JOBS of them at once.
+pids=()
+pid_parts=()
 for ((current_part = 1; current_part <= TOTAL_PARTS; current_part++)); do
-    file="part_${current_part}.txt"
+    [ ${#pids[@]} -ge $MAX_JOBS ] && wait_for_oldest_part
     echo -e "Converting part $current_part of $TOTAL_PARTS to MP3 at ${SPEED} speed with voice ${VOICE}... ️🎶" | lolcat
-    
-    # Use a pipe to send the content of the file to ospeak with the chosen speed and voice
-    cat "$file" | ospeak --voice $VOICE --speed $SPEED -o "${file%.txt}.mp3"
-    if [ $? -ne 0 ]; then
-        echo -e "❌ Error occurred while converting part $current_part. Exiting." | lolcat
-        exit 1
-    fi
+
+    convert_part "part_${current_part}.txt" &
+    pids+=($!)
+    pid_parts+=($current_part)
+done
+while [ ${#pids[@]} -gt 0 ]; do
+    wait_for_oldest_part
 done
 
 # Concatenate all MP3 files
 echo -e "Stitching all MP3 files together... 🧵🎵" | lolcat
-ffmpeg -f concat -safe 0 -i <(for f in part_*.mp3; do echo "file '$PWD/$f'"; done) -c copy output.mp3
+# Write to a temporary file and rename it on success, so a failed or
+# interrupted stitch never leaves a truncated audiobook behind. Only errors are
+# kept from ffmpeg's output, to show them if stitching fails.
+part_list=()
+for ((i = 1; i <= TOTAL_PARTS; i++)); do
+    part_list+=("file '$PWD/part_${i}.mp3'")
+done
+stitch_errors=$(ffmpeg -nostdin -hide_banner -loglevel error -f concat -safe 0 -i <(printf '%s\n' "${part_list[@]}") -c copy -y "$PARTIAL_FILE" 2>&1 >/dev/null)
 
 if [ $? -ne 0 ]; then
+    rm -f "$PARTIAL_FILE"
 clear
     echo -e "❌ Error occurred while stitching MP3 files. Exiting." | lolcat
+    echo "$stitch_errors"
     exit 1
 fi
+mv -f "$PARTIAL_FILE" "$OUTPUT_FILE"
 clear
-echo -e "Final output file 'output.mp3' is ready! 🌟🎉" | lolcat
+echo -e "Final output file '$OUTPUT_FILE' is ready! 🌟🎉" | lolcat